@@ -1,12 +1,15 @@
 """
 This code generates a hue* cyclically rotated over time.
 
-The original image is sliced into equal or near-equal size data chunks and pushed into
-a multiprocessing queue in order to be processed simultaneously by designated number
-of sub-process called <<listener>>. Those process are spawn at start and
-run in the background, waiting for data to be pushed.
-When a job is complete, process are becoming idle until another job is pushed into the queue.
-When all image portions have been processed (Queue empty), the image reconstruction is taking place.
+The original image is sliced into equal or near-equal size data chunks in order to be
+processed simultaneously by designated number of sub-process called <<listener>>.
+The image is held in shared memory, each listener works in place on its own chunk.
+Those process are spawn at start and run in the background, waiting for a new frame.
+The main process starts a frame by setting the frame number and releasing a semaphore
+per listener, each listener releases a common semaphore at the end of its chunk (barrier).
+When a job is complete, process are becoming idle until the next frame is started.
+When all image portions have been processed, the hue shifted image is already complete
+and is displayed without reconstruction.
 
 By default, the number of process will be equivalent to the number of cpu's core (or cpu thread).
 This value can be updated manually, but I don't recommend using 3 times more process than you cpu
@@ -14,8 +17,10 @@ is capable of handling. This is particularly true in environment where CPU power
 Spawning too many process at once will lag the system in its routine tasks and the whole system may become
 momentarily unresponsive.
 
-The hue method is not fully optimised and can of course be improve,
-it just serve the purpose of the demonstration.
+The hue shift kernel is selected at start: the optional C extension (AVX2, build it
+with <<python hueshift_build.py>>), numba when installed, otherwise numpy.
+When CuPy and a CUDA device are available, the image stays on the GPU and is
+processed in a single pass by the main process (no listener).
 
 This algorithm was originally developed for a 2D video game to boost the processing time
 and create real time rendering effects.
@@ -50,14 +55,40 @@ Please acknowledge and give reference if using the source code for your project
 
 """
 
-import pygame
 import numpy
-from numpy import putmask
 import multiprocessing
-from multiprocessing import Process, Queue, freeze_support
-import hashlib
-import colorsys
+from multiprocessing import freeze_support
+from multiprocessing.shared_memory import SharedMemory
 import time
+import functools
+import os
+import sys
+
+try:
+    from numba import njit, prange, set_num_threads
+    NUMBA = True
+except ImportError:
+    # Numba is optional, hsv_shift (numpy) is used instead.
+    NUMBA = False
+
+try:
+    # Optional C kernel, see hueshift_build.py
+    from _hueshift import ffi, lib
+    HUESHIFT_C = True
+except ImportError:
+    HUESHIFT_C = False
+
+try:
+    # Optional GPU backend, the whole image is processed in a single pass
+    import cupy
+except ImportError:
+    CUPY = False
+else:
+    try:
+        CUPY = cupy.cuda.runtime.getDeviceCount() > 0
+    except cupy.cuda.runtime.CUDARuntimeError:
+        # CuPy installed without a CUDA device or driver
+        CUPY = False
 
 __author__ = "Yoann Berenguer"
 __copyright__ = "Copyright 2007."
@@ -68,75 +99,433 @@ __maintainer__ = "Yoann Berenguer"
 __email__ = "yoyoberenguer@hotmail.com"
 __status__ = "Demo"
 
-
-class Listener(Process):
-    shift = 0
-
-    def __init__(self, listener_name_, data_, out_, event_):
-        super(Process, self).__init__()
-        self.out_ = out_
-        self.data = data_
-        self.shift = Listener.shift
+# Bits per channel of the colour lookup table (e.g. 5 for 32 x 32 x 32 colours).
+# The table is rebuilt for every frame, it is only worth it for images much
+# larger than the table (LUT_RATIO per listener). The lookup is lossy, colours
+# are quantised to LUT_BITS (up to 12 levels of error with 5 bits), it is
+# disabled by default (0, every pixel is computed).
+LUT_BITS = 0
+LUT_RATIO = 8
+
+# Hue shift between two frames
+HUE_STEP = 0.01
+# Frame number broadcast to the listeners to terminate the process
+SENTINEL = -1
+# Seconds without any message before checking that the other side
+# (main process or listeners) is still alive.
+TIMEOUT = 1.0
+
+# HSV -> RGB (numpy kernel), every channel is a weighted sum of the pixel
+# min and delta: out = min + delta * (SECTOR_COEFF[0] + SECTOR_COEFF[1] * f)
+# with f the position in the sector. Rows are red, green and blue and
+# columns the 6 sectors of the colour wheel.
+SECTOR_COEFF = numpy.array((((1, 1, 0, 0, 0, 1), (0, 1, 1, 1, 0, 0), (0, 0, 0, 1, 1, 1)),
+                            ((0, -1, 0, 0, 1, 0), (1, 0, 0, -1, 0, 0), (0, 0, 1, 0, 0, -1))),
+                           dtype=numpy.float32)
+
+
+def _reference_shift_hue(r, g, b, shift):
+    """
+    Reference hue shift of a single colour (colorsys), used to validate the array
+    kernels on a few sample colours. Never use it at the pixel level.
+
+    :param r, g, b: int, colour (0 - 255)
+    :param shift: float, hue shift (1.0 is a full revolution of the colour wheel)
+    :return: tuple (r, g, b) int, hue shifted colour
+    """
+    import colorsys
+    h, s, v = colorsys.rgb_to_hsv(r / 255.0, g / 255.0, b / 255.0)
+    rgb = colorsys.hsv_to_rgb((h + shift) % 1.0, s, v)
+    return tuple(int(c * 255.0 + 0.5) for c in rgb)
+
+
+def hsv_scratch(shape):
+    """
+    Work arrays used by hsv_shift, allocated once for a given plane shape and reused
+    for every frame (no allocation in the hot path).
+
+    :param shape: tuple (w, h), shape of the colour planes
+    :return: dict of numpy.ndarray
+    """
+    scratch = {name: numpy.empty(shape, dtype=numpy.float32)
+               for name in ('r', 'g', 'b', 'mx', 'mn', 'd', 'dz', 'h', 'a')}
+    scratch['i'] = numpy.empty(shape, dtype=numpy.int32)
+    scratch['mask'] = numpy.empty(shape, dtype=numpy.bool_)
+    return scratch
+
+
+def hsv_shift(red, green, blue, red_out, green_out, blue_out, shift, scratch=None):
+    """
+    Rotate the hue of an RGB image given as three colour planes.
+    The conversion RGB -> HSV -> RGB is performed on whole arrays (numpy C loops),
+    there is no python code executed at the pixel level. Every operation writes
+    into the work arrays (out=), values are kept in the range [0, 255].
+
+    :param red, green, blue: numpy.ndarray (w, h) uint8, source colour planes
+    :param red_out, green_out, blue_out: numpy.ndarray (w, h) uint8 receiving the hue shifted planes
+    :param shift: float, hue shift (1.0 is a full revolution of the colour wheel)
+    :param scratch: dict, work arrays (see hsv_scratch), allocated if None
+    """
+    if scratch is None:
+        scratch = hsv_scratch(red.shape)
+    r, g, b = scratch['r'], scratch['g'], scratch['b']
+    mx, mn, d, dz = scratch['mx'], scratch['mn'], scratch['d'], scratch['dz']
+    h, a, i, mask = scratch['h'], scratch['a'], scratch['i'], scratch['mask']
+    numpy.copyto(r, red)
+    numpy.copyto(g, green)
+    numpy.copyto(b, blue)
+
+    # RGB -> HSV
+    numpy.maximum(r, g, out=mx)
+    numpy.maximum(mx, b, out=mx)
+    numpy.minimum(r, g, out=mn)
+    numpy.minimum(mn, b, out=mn)
+    numpy.subtract(mx, mn, out=d)
+    # Grey pixels (d = 0) have no hue, avoid the division by zero.
+    numpy.maximum(d, numpy.float32(0.5), out=dz)
+    # max is blue, green then red (red has the priority)
+    numpy.subtract(r, g, out=h)
+    numpy.divide(h, dz, out=h)
+    numpy.add(h, numpy.float32(4.0), out=h)
+    numpy.subtract(b, r, out=a)
+    numpy.divide(a, dz, out=a)
+    numpy.add(a, numpy.float32(2.0), out=a)
+    numpy.equal(mx, g, out=mask)
+    numpy.copyto(h, a, where=mask)
+    numpy.subtract(g, b, out=a)
+    numpy.divide(a, dz, out=a)
+    numpy.equal(mx, r, out=mask)
+    numpy.copyto(h, a, where=mask)
+    # shift the hue
+    numpy.multiply(h, numpy.float32(1.0 / 6.0), out=h)
+    numpy.add(h, numpy.float32(shift), out=h)
+    numpy.remainder(h, numpy.float32(1.0), out=h)
+
+    # HSV -> RGB, 6 sectors of the colour wheel.
+    # v * (1 - s) is the minimum and v * s the delta, the sector weights
+    # (SECTOR_COEFF) are gathered per pixel, no branch and no selection.
+    numpy.multiply(h, numpy.float32(6.0), out=h)
+    numpy.copyto(i, h, casting='unsafe')
+    numpy.subtract(h, i, out=h, casting='unsafe')
+    numpy.remainder(i, 6, out=i)
+    # r, g are free, reused for the weights
+    w0, w1 = r, g
+    for channel, out in enumerate((red_out, green_out, blue_out)):
+        numpy.take(SECTOR_COEFF[0, channel], i, out=w0)
+        numpy.take(SECTOR_COEFF[1, channel], i, out=w1)
+        numpy.multiply(w1, h, out=w1)
+        numpy.add(w0, w1, out=w0)
+        numpy.multiply(w0, d, out=w0)
+        numpy.add(w0, mn, out=w0)
+        numpy.add(w0, numpy.float32(0.5), out=w0)
+        numpy.copyto(out, w0, casting='unsafe')
+
+
+if NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def hue_shift_numba(red, green, blue, red_out, green_out, blue_out, shift):
+        """
+        Rotate the hue of an RGB image given as three colour planes (compiled with numba).
+        RGB -> HSV -> RGB is done in a single pass over the memory with integer
+        (fixed point) arithmetic, rows are processed in parallel.
+        The hue is expressed in 1536 steps (6 sectors x 256), the position in the
+        sector (0 - 255) is used directly to interpolate between the min and max values.
+
+        :param red, green, blue: numpy.ndarray (w, h) uint8, source colour planes
+        :param red_out, green_out, blue_out: numpy.ndarray (w, h) uint8 receiving the hue shifted planes
+        :param shift: float, hue shift (1.0 is a full revolution of the colour wheel)
+        """
+        shift_q = numpy.int32(numpy.floor(shift * 1536.0)) % 1536
+        for y in prange(red.shape[0]):
+            for x in range(red.shape[1]):
+                r = numpy.int32(red[y, x])
+                g = numpy.int32(green[y, x])
+                b = numpy.int32(blue[y, x])
+                mx = max(r, g, b)
+                mn = min(r, g, b)
+                d = mx - mn
+                # Grey pixel, no hue to shift
+                if d == 0:
+                    red_out[y, x] = red[y, x]
+                    green_out[y, x] = green[y, x]
+                    blue_out[y, x] = blue[y, x]
+                    continue
+                # hue in the range [-256, 1280]
+                if mx == r:
+                    h = ((g - b) << 8) // d
+                elif mx == g:
+                    h = 512 + ((b - r) << 8) // d
+                else:
+                    h = 1024 + ((r - g) << 8) // d
+                h = (h + shift_q + 1536) % 1536
+                i = h >> 8
+                f = (d * (h & 255) + 128) >> 8
+                p = mn
+                q = mx - f
+                t = mn + f
+                if i == 0:
+                    r, g, b = mx, t, p
+                elif i == 1:
+                    r, g, b = q, mx, p
+                elif i == 2:
+                    r, g, b = p, mx, t
+                elif i == 3:
+                    r, g, b = p, q, mx
+                elif i == 4:
+                    r, g, b = t, p, mx
+                else:
+                    r, g, b = mx, p, q
+                red_out[y, x] = r
+                green_out[y, x] = g
+                blue_out[y, x] = b
+
+
+def hue_shift_c(red, green, blue, red_out, green_out, blue_out, shift):
+    """
+    Rotate the hue of an RGB image given as three colour planes with the C kernel
+    (hueshift.c, AVX2). Same fixed point arithmetic as hue_shift_numba.
+
+    :param red, green, blue: numpy.ndarray (w, h) uint8, source colour planes (C contiguous)
+    :param red_out, green_out, blue_out: numpy.ndarray (w, h) uint8 receiving the hue shifted planes
+    :param shift: float, hue shift (1.0 is a full revolution of the colour wheel)
+    """
+    lib.hue_shift(ffi.from_buffer('uint8_t[]', red),
+                  ffi.from_buffer('uint8_t[]', green),
+                  ffi.from_buffer('uint8_t[]', blue),
+                  ffi.from_buffer('uint8_t[]', red_out, require_writable=True),
+                  ffi.from_buffer('uint8_t[]', green_out, require_writable=True),
+                  ffi.from_buffer('uint8_t[]', blue_out, require_writable=True),
+                  red.size, int(numpy.floor(shift * 1536.0)) % 1536)
+
+
+if CUPY:
+    # Same fixed point arithmetic as hue_shift_numba and hueshift.c, one thread per pixel.
+    _HUE_SHIFT_GPU = cupy.ElementwiseKernel(
+        'uint8 red, uint8 green, uint8 blue, int32 shift_q',
+        'uint8 red_out, uint8 green_out, uint8 blue_out',
+        '''
+        int r = red, g = green, b = blue;
+        int mx = max(max(r, g), b);
+        int mn = min(min(r, g), b);
+        int d = mx - mn;
+        if (d == 0) {
+            red_out = red; green_out = green; blue_out = blue;
+        } else {
+            int h;
+            if (mx == r)
+                h = (int)floorf((float)(g - b) * 256.0f / (float)d);
+            else if (mx == g)
+                h = 512 + (int)floorf((float)(b - r) * 256.0f / (float)d);
+            else
+                h = 1024 + (int)floorf((float)(r - g) * 256.0f / (float)d);
+            h = (h + shift_q + 1536) % 1536;
+            int f = (d * (h & 255) + 128) >> 8;
+            int q = mx - f, t = mn + f;
+            switch (h >> 8) {
+                case 0: red_out = mx; green_out = t;  blue_out = mn; break;
+                case 1: red_out = q;  green_out = mx; blue_out = mn; break;
+                case 2: red_out = mn; green_out = mx; blue_out = t;  break;
+                case 3: red_out = mn; green_out = q;  blue_out = mx; break;
+                case 4: red_out = t;  green_out = mn; blue_out = mx; break;
+                default: red_out = mx; green_out = mn; blue_out = q; break;
+            }
+        }
+        ''',
+        'hue_shift_gpu')
+
+
+def hue_shift_gpu(red, green, blue, red_out, green_out, blue_out, shift):
+    """
+    Rotate the hue of an RGB image given as three colour planes held on the GPU (CuPy).
+    Same fixed point arithmetic as hue_shift_numba, the arrays are not copied
+    between the host and the device.
+
+    :param red, green, blue: cupy.ndarray (w, h) uint8, source colour planes
+    :param red_out, green_out, blue_out: cupy.ndarray (w, h) uint8 receiving the hue shifted planes
+    :param shift: float, hue shift (1.0 is a full revolution of the colour wheel)
+    """
+    _HUE_SHIFT_GPU(red, green, blue, int(numpy.floor(shift * 1536.0)) % 1536,
+                   red_out, green_out, blue_out)
+
+
+def lut_planes(bits):
+    """
+    Colour cube sampled at the centre of each bin, used to build a lookup table
+    with the hue shift kernels. Each plane has the shape (2 ** bits, 2 ** (2 * bits)),
+    the red bin is the first index, green and blue bins are packed in the second.
+
+    :param bits: int, bits per channel
+    :return: tuple of numpy.ndarray uint8 (red, green, blue planes)
+    """
+    n = 1 << bits
+    half = 1 << (7 - bits)
+    index = numpy.arange(n ** 3, dtype=numpy.int32).reshape(n, n * n)
+    red = ((index >> (2 * bits)) << (8 - bits)) | half
+    green = (((index >> bits) & (n - 1)) << (8 - bits)) | half
+    blue = ((index & (n - 1)) << (8 - bits)) | half
+    return red.astype(numpy.uint8), green.astype(numpy.uint8), blue.astype(numpy.uint8)
+
+
+def lut_lookup(red, green, blue, red_out, green_out, blue_out, lut_red, lut_green, lut_blue, bits):
+    """
+    Replace every colour of an image (three colour planes) by its entry in a lookup table.
+
+    :param red, green, blue: numpy.ndarray (w, h) uint8, source colour planes
+    :param red_out, green_out, blue_out: numpy.ndarray (w, h) uint8 receiving the new planes
+    :param lut_red, lut_green, lut_blue: numpy.ndarray uint8, lookup table (see lut_planes)
+    :param bits: int, bits per channel of the lookup table
+    """
+    i = red >> (8 - bits)
+    j = (green.astype(numpy.int32) >> (8 - bits) << bits) | (blue >> (8 - bits))
+    red_out[...] = lut_red[i, j]
+    green_out[...] = lut_green[i, j]
+    blue_out[...] = lut_blue[i, j]
+
+
+if NUMBA:
+    @njit(parallel=True, cache=True)
+    def lut_lookup_numba(red, green, blue, red_out, green_out, blue_out, lut_red, lut_green, lut_blue, bits):
+        """
+        Replace every colour of an image (three colour planes) by its entry
+        in a lookup table (compiled with numba), see lut_lookup.
+        """
+        for y in prange(red.shape[0]):
+            for x in range(red.shape[1]):
+                i = red[y, x] >> (8 - bits)
+                j = ((green[y, x] >> (8 - bits)) << bits) | (blue[y, x] >> (8 - bits))
+                red_out[y, x] = lut_red[i, j]
+                green_out[y, x] = lut_green[i, j]
+                blue_out[y, x] = lut_blue[i, j]
+
+
+def planar_chunk(buffer, start, end, height):
+    """
+    View of a chunk of an image in shared memory. The chunks are stored back to back,
+    each one as three contiguous colour planes (red, green, blue), a listener works
+    on a single contiguous block of memory.
+
+    :param buffer: memoryview, shared memory buffer holding the image
+    :param start, end: int, chunk boundaries (first axis of the image)
+    :param height: int, image height (second axis)
+    :return: numpy.ndarray (3, end - start, height) uint8
+    """
+    return numpy.ndarray((3, end - start, height), dtype=numpy.uint8,
+                         buffer=buffer, offset=3 * height * start)
+
+
+# Fork is cheaper than spawn (no interpreter start and no module import per
+# listener), it is only used on Linux where it is safe before pygame.init.
+CONTEXT = multiprocessing.get_context('fork' if sys.platform.startswith('linux') else 'spawn')
+
+
+class Listener(CONTEXT.Process):
+
+    def __init__(self, listener_name_, shared_, lut_, frame_, start_, done_):
+        """
+        :param listener_name_: int, listener number (also the chunk number)
+        :param shared_: tuple (source name, target name, height, (start, end)),
+                        shared memory blocks holding the source and target images
+                        (see planar_chunk), image height and the portion of the image
+                        (w axis) allocated to the listener
+        :param lut_: bool, go through the colour lookup table (same choice for all the listeners)
+        :param frame_: multiprocessing.Value, current frame number (shared by all the listeners)
+        :param start_: multiprocessing.Semaphore, released once when a new frame number is set
+        :param done_: multiprocessing.Semaphore, released at the end of each job
+        """
+        super(Listener, self).__init__()
+        self.shared = shared_
+        self.lut = lut_
+        self.frame = frame_
+        self.start_ = start_
+        self.done = done_
         self.listener_name = listener_name_
-        self.event = event_
-        self.stop = False
-
-    def shift_hue(self, r, g, b):
-
-        hue_ = pygame.Color(int(r), int(g), int(b)).hsva
-        # shift the hue
-        hue_ = ((hue_[0] * 0.0027) + self.shift, hue_[1] * 0.01, hue_[2] * 0.01)  # (1/360, 1/100, 1/100)
-        rgb_color = colorsys.hsv_to_rgb(*(hue_[:3]))
-        return rgb_color[0] * 255, rgb_color[1] * 255, rgb_color[2] * 255
-
-    def shift_hue_loop(self, rgb_array):
-        for x in range(rgb_array.shape[0]):
-            for y in range(rgb_array.shape[1]):
-                color_ = rgb_array[x, y][:3]
-                hue_ = pygame.Color(int(color_[0]), int(color_[1]), int(color_[2])).hsva
-                hue_ = ((hue_[0] * 0.0027) + self.shift, hue_[1] * 0.01, hue_[2] * 0.01)
-                rgb_color = colorsys.hsv_to_rgb(*(hue_[:3]))
-                rgb_array[x, y] = rgb_color[0] * 255, rgb_color[1] * 255, rgb_color[2] * 255
-        return rgb_array
 
     def run(self):
-        while not self.event.is_set():
-            # if data is present in the list
-            if self.data[self.listener_name] is not None:
-                rgb_array = self.data[self.listener_name]
-
-                vectorize_ = numpy.vectorize(self.shift_hue)
-                source_array_ = vectorize_(rgb_array[:, :, 0],
-                                           rgb_array[:, :, 1],
-                                           rgb_array[:, :, 2])
-
-                source_array_ = numpy.array(source_array_).transpose(1, 2, 0)
-
-                # source_array_=self.shift_hue_algo(rgb_array)
-
-                # Send the data throughout the QUEUE
-                self.out_.put({self.listener_name: source_array_})
-                # Delete the job from the list (self.data).
-                # This will place the current process in idle
-                self.data[self.listener_name] = None
-                # print('Listener %s complete ' % self.listener_name)
-                self.shift += 0.01
-            # Minimize the CPU utilization while the process
-            # is listening.
-            time.sleep(0.005)
+        source_name, target_name, height, (start, end) = self.shared
+        # Attach the shared memory once, the views below are
+        # persistent, nothing is copied between the processes.
+        source_shm = SharedMemory(name=source_name)
+        target_shm = SharedMemory(name=target_name)
+        source = planar_chunk(source_shm.buf, start, end, height)
+        target = planar_chunk(target_shm.buf, start, end, height)
+        # red, green, blue planes followed by the output planes
+        planes = (source[0], source[1], source[2], target[0], target[1], target[2])
+        assert all(plane.flags['C_CONTIGUOUS'] for plane in planes), \
+            'Expecting contiguous chunks for listener %s ' % self.listener_name
+
+        # Colour lookup table built for each frame (only 2 ** (3 * LUT_BITS)
+        # colours to shift), followed by a simple lookup.
+        use_lut = self.lut
+        if use_lut:
+            lut_source = lut_planes(LUT_BITS)
+            lut = tuple(numpy.empty_like(plane) for plane in lut_source)
+
+        if HUESHIFT_C:
+            hue_shift = hue_shift_c
+        elif NUMBA:
+            hue_shift = hue_shift_numba
+        else:
+            # The numpy kernel work arrays are allocated once, for the
+            # plane shape it will be used with (chunk or lookup table).
+            scratch = hsv_scratch(lut_source[0].shape if use_lut else planes[0].shape)
+            hue_shift = functools.partial(hsv_shift, scratch=scratch)
+        lookup = lut_lookup_numba if NUMBA else lut_lookup
+
+        if hasattr(os, 'sched_setaffinity'):
+            # Pin the listener to a core (not available on Windows and macOS), the
+            # same chunk is processed every frame and stays in the core caches.
+            cores = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cores[self.listener_name % len(cores)]})
+
+        if NUMBA:
+            # One listener per core, the numba kernels are not using more
+            # threads (PROCESS x cpu_count threads otherwise).
+            set_num_threads(1)
+            # Compile (or load from the disk cache) the kernels before the first job,
+            # rather than during the first frame. This is done in the sub-process,
+            # a numba thread pool started in the parent does not survive a fork.
+            hue_shift(*planes, 0.0)
+            if use_lut:
+                hue_shift(*lut_source, *lut, 0.0)
+                lookup(*planes, *lut, LUT_BITS)
+        parent = multiprocessing.parent_process()
+        frame = 0
+        while True:
+            # Block until a new frame is started (no polling),
+            # the timeout only serves to stop an orphan listener.
+            if not self.start_.acquire(timeout=TIMEOUT):
+                if parent is not None and not parent.is_alive():
+                    break
+                continue
+            frame = self.frame.value
+            if frame == SENTINEL:
+                break
+            shift = frame * HUE_STEP
+
+            # Results are written directly into the shared target image
+            if use_lut:
+                hue_shift(*lut_source, *lut, shift)
+                lookup(*planes, *lut, LUT_BITS)
+            else:
+                hue_shift(*planes, shift)
+
+            # Signal the end of the job
+            self.done.release()
+
+        del source, target, planes
+        source_shm.close()
+        target_shm.close()
         print('Listener %s is dead.' % self.listener_name)
 
 
 class SplitSurface:
 
-    def __init__(self, process_: int, array_, queue, check_: bool = False):
+    def __init__(self, process_: int, array_, buffer_, bounds_=None):
 
         assert isinstance(process_, int), \
             'Expecting an int for argument process_, got %s ' % type(process_)
         assert isinstance(array_, numpy.ndarray), \
             'Expecting numpy.ndarray for argument array_, got %s ' % type(array_)
-        assert isinstance(check_, bool), \
-            'Expecting bool for argument check_, got %s ' % type(check_)
 
         self.process = process_  # Process number
         self.shape = array_.shape  # array shape
@@ -144,169 +533,176 @@ class SplitSurface:
         self.pixels = array_.size / self.c  # Pixels [w x h]
         self.size = array_.size  # Array size [w x h x colors]
         self.array = array_  # surface (numpy.array)
-        self.queue = queue
-        self.split_array = []
-        # self.split()
+        self.buffer = buffer_  # shared memory receiving the chunks
+        # Chunks boundaries (start, end), computed if not given
+        self.chunks = self.bounds(self.col, self.process) if bounds_ is None else bounds_
         self.split_non_equal()
 
-        # Checking hashes (input array & output)
-        # Below works only if the array is rebuild
-        # if check_:
-        #    self.hash = hashlib.md5()
-        #    self.hash.update(array_.copy('C'))
-        #    self.hash_ = hashlib.md5()
-        #    self.hash_.update(self.split_array.copy('C'))
-        #    assert self.hash.hexdigest() == self.hash_.hexdigest(), \
-        #        '\n[-] Secure hashes does not match.'
-
-    def split_equal(self):
-        # Split array into multiple sub-arrays of equal size.
-        self.split_array = numpy.split(self.array, self.process)
-        self.queue.put(self.split_array)
+    @staticmethod
+    def bounds(length_: int, process_: int):
+        # Boundaries (start, end) of process_ chunks of equal or near-equal size.
+        sizes = [len(indices) for indices in numpy.array_split(numpy.arange(length_), process_)]
+        edges = numpy.cumsum([0] + sizes)
+        return [(int(edges[i]), int(edges[i + 1])) for i in range(process_)]
 
     def split_non_equal(self):
         # Split an array into multiple sub-arrays of equal or near-equal size.
         #  Does not raise an exception if an equal division cannot be made.
-        split_ = numpy.array_split(self.array, self.process, 1)
-        # self.split_array = numpy.vstack((split_[i] for i in range(self.process)))
-        self.queue.put(split_)
-
-    def split(self):
-
-        split_array = []
-
-        # chunk size (d_column, d_row) for a given number of process.
-        d_column, d_row = self.col // self.process, self.row
-        # cut chunks of data from the surface (numpy 3D array).
-        print(d_column, d_row)
-        split_size = 0
-        # Summing the chunks and calculate the remainder if any.
-        for i in range(self.process):
-            split_array.append(self.array[0:d_row, i * d_column:i * d_column + d_column])
-            split_size += split_array[i]
-
-        remainder = int((self.pixels - self.process * d_column * d_row))
-
-        # Remainder not null --> Adding the remainder to the last chunk
-        # todo - we could also split the remainder into the number of process and split the value
-        if remainder != 0:
-            split_array[self.process - 1] = self.array[0:d_row,
-                                            (self.process - 1) * d_column:(self.process - 1) * d_column + d_column + (
-                                                        remainder // d_row)]
-
-        self.queue.put(split_array)
-
-        # rebuild complete array
-        # self.split_array = numpy.hstack((split_array[i] for i in range(self.process)))
-        # self.queue.put(self.split_array)
+        # The split is done along the first axis, each chunk is copied into the buffer
+        # as three contiguous colour planes, chunks back to back (planar_chunk).
+        # Each listener reads and writes its own portion in place (no copy, no reassembly).
+        for start, end in self.chunks:
+            planar_chunk(self.buffer, start, end, self.row)[...] = \
+                numpy.moveaxis(self.array[start:end], -1, 0)
 
 
 if __name__ == '__main__':
     freeze_support()
+    # Only the main process is using pygame (display and image loading)
+    import pygame
+
     # Map size
     SIZE = (200, 200)
-    SCREENRECT = pygame.Rect((0, 0), SIZE)
-    pygame.init()
-    SCREEN = pygame.display.set_mode(SCREENRECT.size, pygame.RESIZABLE, 32)
-    TEXTURE1 = pygame.image.load("Assets\\orange-hooded-gouldian-finch.jpg").convert()
-    TEXTURE1 = pygame.transform.smoothscale(TEXTURE1, SIZE)
-
-    array = pygame.surfarray.pixels3d(TEXTURE1)
-
-    # Test for single thread
-    def shift_hue_loop(rgb_array):
-        for x in range(rgb_array.shape[0]):
-            for y in range(rgb_array.shape[1]):
-                color_ = rgb_array[x, y][:3]
-                hue_ = pygame.Color(int(color_[0]), int(color_[1]), int(color_[2])).hsva
-                hue_ = ((hue_[0] * 0.0027) + 0.01, hue_[1] * 0.01, hue_[2] * 0.01)
-                rgb_color = colorsys.hsv_to_rgb(*(hue_[:3]))
-                rgb_array[x, y] = rgb_color[0] * 255, rgb_color[1] * 255, rgb_color[2] * 255
-        return rgb_array
-
-    PROCESS = multiprocessing.cpu_count()
-
-    QUEUE_OUT = multiprocessing.Queue()
-    QUEUE_IN = multiprocessing.Queue()
-    EVENT = multiprocessing.Event()
-
-    MANAGER = multiprocessing.Manager()
-
-    DATA = MANAGER.dict()
-
-    SplitSurface(PROCESS, array, QUEUE_IN)
-    new_array = QUEUE_IN.get()
-
-    i = 0
-    for array in new_array:
-        DATA[i] = array
-        i += 1
 
+    # The GPU processes the whole image at once, there is no listener.
+    PROCESS = 0 if CUPY else multiprocessing.cpu_count()
+
+    if CUPY:
+        # A single chunk, the hue shifted image is copied back from the device
+        BOUNDS = [(0, SIZE[0])]
+        TARGET_GPU = cupy.empty((3,) + SIZE, dtype=cupy.uint8)
+        TARGET_CHUNKS = [numpy.empty((3,) + SIZE, dtype=numpy.uint8)]
+    else:
+        # Chunks boundaries (first axis)
+        BOUNDS = SplitSurface.bounds(SIZE[0], PROCESS)
+
+        # Source and hue shifted images are shared with the listeners.
+        # Each chunk is stored as three contiguous colour planes rather than
+        # interleaved RGB, the listeners only see unit stride arrays.
+        SOURCE_SHM = SharedMemory(create=True, size=3 * SIZE[0] * SIZE[1])
+        TARGET_SHM = SharedMemory(create=True, size=3 * SIZE[0] * SIZE[1])
+        TARGET_CHUNKS = [planar_chunk(TARGET_SHM.buf, start, end, SIZE[1]) for start, end in BOUNDS]
+
+    # Each listener is always processing the same portion of the image, a new frame
+    # is started by setting the frame number and releasing every listener semaphore
+    # (never blocking the main process, even if a listener is dead).
+    FRAME_NUMBER = CONTEXT.Value('i', 0, lock=False)
+    FRAME_START = [CONTEXT.Semaphore(0) for i in range(PROCESS)]
+    # Released once by every listener at the end of a frame
+    FRAME_DONE = CONTEXT.Semaphore(0)
+
+    # Lossy colour lookup table, decided once for the whole image (every chunk has
+    # the same quality), only when the image is much larger than the table.
+    USE_LUT = LUT_BITS > 0 and SIZE[0] * SIZE[1] >= PROCESS * (LUT_RATIO << (3 * LUT_BITS))
+
+    # The listeners are spawned once, before pygame and the display are initialised
+    # (a forked process would otherwise inherit the SDL state). They wait for
+    # their first job while the image is loaded.
     t1 = time.time()
-    for i in range(PROCESS):
-        Listener.shift = 0.0
-        Listener(i, DATA, QUEUE_OUT, EVENT).start()
-
-    FRAME = 0
-    clock = pygame.time.Clock()
-    STOP_GAME = False
-    PAUSE = False
-
-    while not STOP_GAME:
-
-        pygame.event.pump()
-
-        while PAUSE:
-            event = pygame.event.wait()
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_PAUSE]:
-                PAUSE = False
-                pygame.event.clear()
-                keys = None
-            break
-
-        for event in pygame.event.get():
-
-            keys = pygame.key.get_pressed()
-
-            if event.type == pygame.QUIT or keys[pygame.K_ESCAPE]:
-                print('Quitting')
-                STOP_GAME = True
-
-            elif event.type == pygame.MOUSEMOTION:
-                MOUSE_POS = event.pos
-
-            elif keys[pygame.K_PAUSE]:
-                PAUSE = True
-                print('Paused')
-
-        t1 = time.time()
-
-        # Push jobs into the Queue
-        i = 0
-        for array in new_array:
-            DATA[i] = array
-            i += 1
-
-        temp = {}
+    LISTENERS = []
+    try:
         for i in range(PROCESS):
-            for key, value in (QUEUE_OUT.get().items()):
-                temp[str(key)] = value
-
-        element = []
-        for key, value in sorted(temp.items(), key=lambda item: (int(item[0]), item[1])):
-            element.append(value)
-
-        # uncomment below for for single thread testing
-        # surface = pygame.surfarray.make_surface(shift_hue_loop(array))
-
-        pygame.surfarray.blit_array(SCREEN, numpy.hstack(list(element)))
-        # print('\n[+] time : ', time.time() - t1)
-
-        pygame.display.flip()
-        TIME_PASSED_SECONDS = clock.tick(350)
-        FRAME += 1
-
-    EVENT.set()
-
-    pygame.quit()
+            shared = (SOURCE_SHM.name, TARGET_SHM.name, SIZE[1], BOUNDS[i])
+            LISTENERS.append(Listener(i, shared, USE_LUT, FRAME_NUMBER, FRAME_START[i], FRAME_DONE))
+            # Daemon, the listeners never outlive the main process (even on error)
+            LISTENERS[i].daemon = True
+            LISTENERS[i].start()
+
+        SCREENRECT = pygame.Rect((0, 0), SIZE)
+        pygame.init()
+        SCREEN = pygame.display.set_mode(SCREENRECT.size, pygame.RESIZABLE, 32)
+        TEXTURE1 = pygame.image.load("Assets\\orange-hooded-gouldian-finch.jpg").convert()
+        TEXTURE1 = pygame.transform.smoothscale(TEXTURE1, SIZE)
+
+        array = pygame.surfarray.pixels3d(TEXTURE1)
+        if CUPY:
+            # Uploaded once, the source image stays on the device
+            SOURCE_GPU = cupy.asarray(numpy.ascontiguousarray(numpy.moveaxis(array, -1, 0)))
+        else:
+            # Copy the image chunks into the shared memory
+            SplitSurface(PROCESS, array, SOURCE_SHM.buf, BOUNDS)
+        del array
+
+        FRAME = 0
+        clock = pygame.time.Clock()
+        STOP_GAME = False
+        PAUSE = False
+
+        while not STOP_GAME:
+
+            pygame.event.pump()
+
+            while PAUSE:
+                event = pygame.event.wait()
+                keys = pygame.key.get_pressed()
+                if keys[pygame.K_PAUSE]:
+                    PAUSE = False
+                    pygame.event.clear()
+                    keys = None
+                break
+
+            for event in pygame.event.get():
+
+                keys = pygame.key.get_pressed()
+
+                if event.type == pygame.QUIT or keys[pygame.K_ESCAPE]:
+                    print('Quitting')
+                    STOP_GAME = True
+
+                elif event.type == pygame.MOUSEMOTION:
+                    MOUSE_POS = event.pos
+
+                elif keys[pygame.K_PAUSE]:
+                    PAUSE = True
+                    print('Paused')
+
+            t1 = time.time()
+
+            FRAME += 1
+            if CUPY:
+                hue_shift_gpu(*SOURCE_GPU, *TARGET_GPU, FRAME * HUE_STEP)
+                TARGET_GPU.get(out=TARGET_CHUNKS[0])
+            else:
+                # Start the frame for all the listeners
+                FRAME_NUMBER.value = FRAME
+                for start in FRAME_START:
+                    start.release()
+
+                # Barrier, wait for all the listeners. Each chunk is written
+                # in place into its own block of TARGET_SHM, nothing to reassemble.
+                for i in range(PROCESS):
+                    while not FRAME_DONE.acquire(timeout=TIMEOUT):
+                        # A listener that died would block the display forever
+                        for listener in LISTENERS:
+                            if not listener.is_alive():
+                                raise RuntimeError('\n[-] Listener %s is dead.' % listener.listener_name)
+
+            # Interleave the colour planes straight into the display surface
+            # pixels (no intermediate RGB array), the reference locks the surface
+            # and is released before the flip.
+            SCREEN_ARRAY = pygame.surfarray.pixels3d(SCREEN)
+            for (start, end), chunk in zip(BOUNDS, TARGET_CHUNKS):
+                SCREEN_ARRAY[start:end] = numpy.moveaxis(chunk, 0, -1)
+            del SCREEN_ARRAY
+            # print('\n[+] time : ', time.time() - t1)
+
+            pygame.display.flip()
+            TIME_PASSED_SECONDS = clock.tick(350)
+
+    finally:
+        # Stop the listeners and release the shared memory, also when the
+        # main loop is interrupted by an error (e.g. a dead listener).
+        FRAME_NUMBER.value = SENTINEL
+        for start in FRAME_START:
+            start.release()
+        for listener in LISTENERS:
+            listener.join(timeout=TIMEOUT)
+
+        del TARGET_CHUNKS
+        if not CUPY:
+            SOURCE_SHM.close()
+            SOURCE_SHM.unlink()
+            TARGET_SHM.close()
+            TARGET_SHM.unlink()
+
+        pygame.quit()
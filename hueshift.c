@@ -0,0 +1,212 @@
+/*
+ * Hue shift kernel for VariableHue.py (C extension, built with hueshift_build.py)
+ *
+ * The image is given as three contiguous colour planes (red, green, blue).
+ * The hue is expressed in 1536 steps (6 sectors x 256), identical to the numba
+ * kernel hue_shift_numba: the sector is h >> 8 and the position in the sector
+ * (0 - 255) interpolates between the min and max values of the pixel.
+ *
+ * With AVX2, 8 pixels are processed per iteration in 32 bit lanes, the sector
+ * selection is branchless (compare + blend). The AVX2 path is compiled for its
+ * own functions only (target attribute) and selected at runtime when the CPU
+ * supports it. The remaining pixels (n % 8), CPUs without AVX2 and other
+ * architectures go through the scalar loop, both paths are using the same
+ * arithmetic and give exactly the same result.
+ *
+ * This code comes with a MIT license.
+ * Copyright (c) 2018 Yoann Berenguer
+ */
+
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define HUESHIFT_AVX2
+#define AVX2_TARGET __attribute__((target("avx2")))
+#include <immintrin.h>
+
+static int cpu_has_avx2(void)
+{
+    __builtin_cpu_init();
+    return __builtin_cpu_supports("avx2");
+}
+#elif defined(_MSC_VER) && (defined(_M_X64) || defined(_M_IX86))
+#define HUESHIFT_AVX2
+#define AVX2_TARGET
+#include <immintrin.h>
+#include <intrin.h>
+
+static int cpu_has_avx2(void)
+{
+    int info[4];
+    __cpuid(info, 0);
+    if (info[0] < 7)
+        return 0;
+    __cpuid(info, 1);
+    /* OSXSAVE and AVX, the OS saves the ymm registers */
+    if ((info[2] & (1 << 27)) == 0 || (info[2] & (1 << 28)) == 0)
+        return 0;
+    if ((_xgetbv(0) & 6) != 6)
+        return 0;
+    __cpuidex(info, 7, 0);
+    return (info[1] & (1 << 5)) != 0;
+}
+#endif
+
+#include "hueshift.h"
+
+
+static inline int hue_part(int num, int d)
+{
+    return (int)floorf((float)num * 256.0f / (float)d);
+}
+
+
+static void hue_shift_scalar(const uint8_t *r_, const uint8_t *g_, const uint8_t *b_,
+                             uint8_t *ro, uint8_t *go, uint8_t *bo, int n, int shift_q)
+{
+    int i;
+    for (i = 0; i < n; i++) {
+        int r = r_[i], g = g_[i], b = b_[i];
+        int mx = r > g ? r : g;
+        int mn = r < g ? r : g;
+        int d, h, sector, f, p, q, t;
+        mx = mx > b ? mx : b;
+        mn = mn < b ? mn : b;
+        d = mx - mn;
+        if (d == 0) {
+            /* Grey pixel, no hue to shift */
+            ro[i] = (uint8_t)r; go[i] = (uint8_t)g; bo[i] = (uint8_t)b;
+            continue;
+        }
+        if (mx == r)
+            h = hue_part(g - b, d);
+        else if (mx == g)
+            h = 512 + hue_part(b - r, d);
+        else
+            h = 1024 + hue_part(r - g, d);
+        h += shift_q;
+        if (h < 0) h += 1536;
+        if (h >= 1536) h -= 1536;
+        sector = h >> 8;
+        f = (d * (h & 255) + 128) >> 8;
+        p = mn;
+        q = mx - f;
+        t = mn + f;
+        switch (sector) {
+            case 0: ro[i] = mx; go[i] = t;  bo[i] = p;  break;
+            case 1: ro[i] = q;  go[i] = mx; bo[i] = p;  break;
+            case 2: ro[i] = p;  go[i] = mx; bo[i] = t;  break;
+            case 3: ro[i] = p;  go[i] = q;  bo[i] = mx; break;
+            case 4: ro[i] = t;  go[i] = p;  bo[i] = mx; break;
+            default: ro[i] = mx; go[i] = p; bo[i] = q;  break;
+        }
+    }
+}
+
+
+#ifdef HUESHIFT_AVX2
+static inline AVX2_TARGET __m256i load8(const uint8_t *ptr)
+{
+    return _mm256_cvtepu8_epi32(_mm_loadl_epi64((const __m128i *)ptr));
+}
+
+
+static inline AVX2_TARGET void store8(uint8_t *ptr, __m256i v)
+{
+    /* 8 x int32 (0 - 255) -> 8 x uint8 */
+    __m256i packed = _mm256_packus_epi32(v, v);
+    packed = _mm256_packus_epi16(packed, packed);
+    uint32_t lo = (uint32_t)_mm_cvtsi128_si32(_mm256_castsi256_si128(packed));
+    uint32_t hi = (uint32_t)_mm_cvtsi128_si32(_mm256_extracti128_si256(packed, 1));
+    memcpy(ptr, &lo, 4);
+    memcpy(ptr + 4, &hi, 4);
+}
+
+
+static inline AVX2_TARGET __m256i select6(__m256i *is, __m256i v0, __m256i v1, __m256i v2,
+                              __m256i v3, __m256i v4, __m256i v5)
+{
+    __m256i out = v5;
+    out = _mm256_blendv_epi8(out, v4, is[4]);
+    out = _mm256_blendv_epi8(out, v3, is[3]);
+    out = _mm256_blendv_epi8(out, v2, is[2]);
+    out = _mm256_blendv_epi8(out, v1, is[1]);
+    out = _mm256_blendv_epi8(out, v0, is[0]);
+    return out;
+}
+
+
+static AVX2_TARGET int hue_shift_avx2(const uint8_t *r_, const uint8_t *g_, const uint8_t *b_,
+                          uint8_t *ro, uint8_t *go, uint8_t *bo, int n, int shift_q)
+{
+    const __m256i zero = _mm256_setzero_si256();
+    const __m256i one = _mm256_set1_epi32(1);
+    const __m256i c255 = _mm256_set1_epi32(255);
+    const __m256i c128 = _mm256_set1_epi32(128);
+    const __m256i c512 = _mm256_set1_epi32(512);
+    const __m256i c1024 = _mm256_set1_epi32(1024);
+    const __m256i c1535 = _mm256_set1_epi32(1535);
+    const __m256i c1536 = _mm256_set1_epi32(1536);
+    const __m256i shift = _mm256_set1_epi32(shift_q);
+    const __m256 c256f = _mm256_set1_ps(256.0f);
+    int i, s;
+
+    for (i = 0; i + 8 <= n; i += 8) {
+        __m256i r = load8(r_ + i), g = load8(g_ + i), b = load8(b_ + i);
+        __m256i mx = _mm256_max_epi32(_mm256_max_epi32(r, g), b);
+        __m256i mn = _mm256_min_epi32(_mm256_min_epi32(r, g), b);
+        __m256i d = _mm256_sub_epi32(mx, mn);
+        __m256i is_r = _mm256_cmpeq_epi32(mx, r);
+        __m256i is_g = _mm256_andnot_si256(is_r, _mm256_cmpeq_epi32(mx, g));
+        __m256i num, base, h, f, p, q, t, is[5], sector;
+        __m256 part;
+
+        /* numerator and base of the hue for the max channel red, green or blue */
+        num = _mm256_sub_epi32(r, g);
+        num = _mm256_blendv_epi8(num, _mm256_sub_epi32(b, r), is_g);
+        num = _mm256_blendv_epi8(num, _mm256_sub_epi32(g, b), is_r);
+        base = _mm256_blendv_epi8(c1024, c512, is_g);
+        base = _mm256_blendv_epi8(base, zero, is_r);
+
+        /* grey pixels (d = 0), f is 0 and the colour is unchanged */
+        part = _mm256_div_ps(_mm256_mul_ps(_mm256_cvtepi32_ps(num), c256f),
+                             _mm256_cvtepi32_ps(_mm256_max_epi32(d, one)));
+        part = _mm256_floor_ps(part);
+        h = _mm256_add_epi32(_mm256_add_epi32(base, _mm256_cvtps_epi32(part)), shift);
+        h = _mm256_add_epi32(h, _mm256_and_si256(_mm256_cmpgt_epi32(zero, h), c1536));
+        h = _mm256_sub_epi32(h, _mm256_and_si256(_mm256_cmpgt_epi32(h, c1535), c1536));
+
+        sector = _mm256_srli_epi32(h, 8);
+        f = _mm256_mullo_epi32(d, _mm256_and_si256(h, c255));
+        f = _mm256_srli_epi32(_mm256_add_epi32(f, c128), 8);
+        p = mn;
+        q = _mm256_sub_epi32(mx, f);
+        t = _mm256_add_epi32(mn, f);
+
+        for (s = 0; s < 5; s++)
+            is[s] = _mm256_cmpeq_epi32(sector, _mm256_set1_epi32(s));
+
+        store8(ro + i, select6(is, mx, q, p, p, t, mx));
+        store8(go + i, select6(is, t, mx, mx, q, p, p));
+        store8(bo + i, select6(is, p, p, t, mx, mx, q));
+    }
+    return i;
+}
+#endif
+
+
+void hue_shift(const uint8_t *r, const uint8_t *g, const uint8_t *b,
+               uint8_t *ro, uint8_t *go, uint8_t *bo, int n, int shift_q)
+{
+    int i = 0;
+#ifdef HUESHIFT_AVX2
+    static int avx2 = -1;
+    if (avx2 < 0)
+        avx2 = cpu_has_avx2();
+    if (avx2)
+        i = hue_shift_avx2(r, g, b, ro, go, bo, n, shift_q);
+#endif
+    hue_shift_scalar(r + i, g + i, b + i, ro + i, go + i, bo + i, n - i, shift_q);
+}
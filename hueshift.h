@@ -0,0 +1,14 @@
+#ifndef HUESHIFT_H
+#define HUESHIFT_H
+
+#include <stdint.h>
+
+/*
+ * Rotate the hue of n pixels given as three colour planes (r, g, b), the
+ * result is written into (ro, go, bo). shift_q is the hue shift in 1536 steps
+ * per revolution (0 - 1535).
+ */
+void hue_shift(const uint8_t *r, const uint8_t *g, const uint8_t *b,
+               uint8_t *ro, uint8_t *go, uint8_t *bo, int n, int shift_q);
+
+#endif
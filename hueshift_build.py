@@ -0,0 +1,34 @@
+"""
+Build the optional C hue shift kernel (hueshift.c) used by VariableHue.py.
+
+    python hueshift_build.py
+
+This creates the _hueshift extension module in the current directory (requires cffi
+and a C compiler). The AVX2 code path is selected at runtime, the extension also works
+on CPUs without AVX2 (scalar loop). When the extension is not available VariableHue.py
+falls back to numba or numpy.
+"""
+
+import sys
+from cffi import FFI
+
+ffibuilder = FFI()
+
+ffibuilder.cdef("""
+    void hue_shift(const uint8_t *r, const uint8_t *g, const uint8_t *b,
+                   uint8_t *ro, uint8_t *go, uint8_t *bo, int n, int shift_q);
+""")
+
+# No -mavx2 / /arch:AVX2, only hue_shift_avx2 is compiled for AVX2 (see hueshift.c)
+if sys.platform == 'win32':
+    EXTRA_COMPILE_ARGS = ['/O2']
+else:
+    EXTRA_COMPILE_ARGS = ['-O3']
+
+ffibuilder.set_source("_hueshift", '#include "hueshift.h"',
+                      sources=['hueshift.c'],
+                      include_dirs=['.'],
+                      extra_compile_args=EXTRA_COMPILE_ARGS)
+
+if __name__ == "__main__":
+    ffibuilder.compile(verbose=True)
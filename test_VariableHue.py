@@ -0,0 +1,113 @@
+"""
+Hue shift kernels checked against the colorsys reference (_reference_shift_hue).
+
+    python -m unittest test_VariableHue
+
+The optional kernels (numba, C extension, CuPy) are skipped when not available.
+"""
+
+import itertools
+import unittest
+
+import numpy
+
+import VariableHue
+from VariableHue import _reference_shift_hue, hsv_shift, lut_planes, lut_lookup
+
+# Sample colours (greys, primaries, secondaries and mixed values) as (6, 36) planes
+LEVELS = (0, 17, 64, 128, 200, 255)
+COLOURS = numpy.array(list(itertools.product(LEVELS, repeat=3)), dtype=numpy.uint8)
+RED, GREEN, BLUE = (numpy.ascontiguousarray(COLOURS[:, c].reshape(6, 36)) for c in range(3))
+SHIFTS = (0.0, 0.13, 0.5, 0.77)
+# Maximum difference with colorsys (levels), the kernels are in float32 or fixed point
+TOLERANCE = 2
+
+
+def reference(shift):
+    """
+    :param shift: float, hue shift
+    :return: numpy.ndarray (3, 6, 36) int, hue shifted sample colours (colorsys)
+    """
+    rgb = [_reference_shift_hue(int(r), int(g), int(b), shift) for r, g, b in COLOURS]
+    return numpy.array(rgb).T.reshape(3, 6, 36)
+
+
+def shifted(kernel, shift):
+    """
+    :param kernel: hue shift kernel (red, green, blue, red_out, green_out, blue_out, shift)
+    :param shift: float, hue shift
+    :return: numpy.ndarray (3, 6, 36) int, hue shifted sample colours
+    """
+    out = [numpy.empty_like(RED) for c in range(3)]
+    kernel(RED, GREEN, BLUE, *out, shift)
+    return numpy.array(out, dtype=numpy.int32)
+
+
+class TestKernels(unittest.TestCase):
+
+    def check(self, kernel):
+        for shift in SHIFTS:
+            error = numpy.abs(shifted(kernel, shift) - reference(shift)).max()
+            self.assertLessEqual(error, TOLERANCE, 'shift %s' % shift)
+
+    def test_hsv_shift(self):
+        self.check(hsv_shift)
+
+    @unittest.skipUnless(VariableHue.NUMBA, 'numba is not installed')
+    def test_hue_shift_numba(self):
+        self.check(VariableHue.hue_shift_numba)
+
+    @unittest.skipUnless(VariableHue.HUESHIFT_C, 'C extension not built (python hueshift_build.py)')
+    def test_hue_shift_c(self):
+        self.check(VariableHue.hue_shift_c)
+
+    @unittest.skipUnless(VariableHue.HUESHIFT_C and VariableHue.NUMBA, 'numba or C extension missing')
+    def test_hue_shift_c_numba(self):
+        # Same fixed point arithmetic, identical results
+        for shift in SHIFTS:
+            numpy.testing.assert_array_equal(shifted(VariableHue.hue_shift_c, shift),
+                                             shifted(VariableHue.hue_shift_numba, shift))
+
+    @unittest.skipUnless(VariableHue.CUPY, 'CuPy or CUDA device not available')
+    def test_hue_shift_gpu(self):
+        cupy = VariableHue.cupy
+
+        def kernel(red, green, blue, red_out, green_out, blue_out, shift):
+            planes = [cupy.asarray(plane) for plane in (red, green, blue)]
+            out = [cupy.empty_like(plane) for plane in planes]
+            VariableHue.hue_shift_gpu(*planes, *out, shift)
+            for host, device in zip((red_out, green_out, blue_out), out):
+                host[...] = cupy.asnumpy(device)
+        self.check(kernel)
+
+
+class TestLookup(unittest.TestCase):
+
+    BITS = 5
+
+    def lookup(self, function, shift):
+        lut_source = lut_planes(self.BITS)
+        lut = tuple(numpy.empty_like(plane) for plane in lut_source)
+        hsv_shift(*lut_source, *lut, shift)
+        out = [numpy.empty_like(RED) for c in range(3)]
+        function(RED, GREEN, BLUE, *out, *lut, self.BITS)
+        return numpy.array(out)
+
+    def test_lut_lookup(self):
+        # Each colour is replaced by the entry of its bin
+        lut_source = lut_planes(self.BITS)
+        out = [numpy.empty_like(RED) for c in range(3)]
+        lut_lookup(RED, GREEN, BLUE, *out, *lut_source, self.BITS)
+        half = 1 << (7 - self.BITS)
+        for plane, source in zip(out, (RED, GREEN, BLUE)):
+            numpy.testing.assert_array_equal(plane, (source >> (8 - self.BITS) << (8 - self.BITS)) | half)
+
+    @unittest.skipUnless(VariableHue.NUMBA, 'numba is not installed')
+    def test_lut_lookup_numba(self):
+        for shift in SHIFTS:
+            numpy.testing.assert_array_equal(self.lookup(VariableHue.lut_lookup_numba, shift),
+                                             self.lookup(lut_lookup, shift))
+
+
+if __name__ == '__main__':
+    unittest.main()